@@ -1,11 +1,10 @@
 # noinspection PyUnreachableCode
-import hashlib
 import math
 import os
-import sqlite3
 import streamlit as st
 import threading
 import time
+from typing import Any, Dict
 from db_utils import init_db
 from exchange_service import ExchangeRateService
 from exchange_service import get_usd_rate
@@ -26,43 +25,7 @@ CACHE_PATH = os.path.join(
     "moex_rate.json")
 
 # 这里不再定义 get_db，也不再直接用 get_db、conn、c
-
-
-def create_user(username, password, role="user", email=None):
-    """创建用户"""
-    conn, c = init_db()  # Assuming init_db returns conn and c
-    hashed = hashlib.sha256(password.encode()).hexdigest()
-    try:
-        c.execute(
-            "INSERT INTO users (username, password, role, email) "
-            "VALUES (?, ?, ?, ?)",
-            (username, hashed, role, email),
-        )
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        return False
-
-
-def verify_user(identifier, password):
-    """验证用户"""
-    conn, c = init_db()  # Assuming init_db returns conn and c
-    hashed = hashlib.sha256(password.encode()).hexdigest()
-    user = c.execute(
-        "SELECT * FROM users "
-        "WHERE (username = ? OR email = ?) AND password = ?",
-        (
-            identifier,
-            identifier,
-            hashed,
-        ),
-    ).fetchone()
-    return dict(user) if user else None
-
-
-def current_user_id():
-    """获取当前用户ID"""
-    return st.session_state.user["id"]
+# 用户相关函数（create_user / verify_user / current_user_id）统一在 db_utils 中
 
 
 def calculate_logistic_cost(logistic, product, debug=False):
@@ -361,7 +324,6 @@ def calculate_logistic_cost(logistic, product, debug=False):
         min_currency = logistic.get("price_min_currency", "RUB")
 
         # 根据货币类型进行价格比较
-        from exchange_service import get_usd_rate
         usd_rate = get_usd_rate()
 
         if limit_currency == "USD" and limit_value > 0:
@@ -634,7 +596,6 @@ def main():
         return
 
     # 用户已登录，显示主界面
-    from typing import Dict, Any
     user: Dict[str, Any] = st.session_state.user  # type: ignore
     st.sidebar.title(f"欢迎, {user['username']}")
     st.sidebar.subheader(f"角色: {user['role']}")
@@ -889,7 +850,6 @@ def _debug_filter_reason(logistic: dict, product: dict) -> str | None:
         min_currency = logistic.get("price_min_currency", "RUB")
 
         # 根据货币类型进行价格比较
-        from exchange_service import get_usd_rate
         usd_rate = get_usd_rate()
 
         if limit_currency == "USD" and limit_value > 0:
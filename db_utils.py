@@ -1,15 +1,78 @@
+import atexit
+import concurrent.futures
+import logging
 import os
 import sqlite3
 import streamlit as st
+import functools
 import hashlib
+import hmac
+import threading
+import time
+
+
+DB_PATH = os.path.join(os.path.dirname(__file__), "pricing_system.db")
+
+# 进程内共享的数据库连接（首次调用 get_db 时创建）
+_CONN = None
+_CONN_LOCK = threading.Lock()
+
+# 写锁：所有会话线程共用同一个连接，连接上的事务也是共用的。
+# 任何写操作（单条写语句、BEGIN…COMMIT 显式事务、commit/rollback）
+# 都必须持有此锁，否则会混进或提交掉别的线程正在进行的事务。
+_WRITE_LOCK = threading.RLock()
+
+# 表结构版本，保存在数据库的 PRAGMA user_version 中；
+# 表结构或索引有改动时递增，下次启动会重新执行一遍升级步骤
+SCHEMA_VERSION = 1
+
+# init_db 在每个进程中只需完整执行一次
+_DB_READY = False
+_DB_INIT_LOCK = threading.Lock()
+
+
+def _apply_pragmas(conn):
+    """连接建立时设置一次的 PRAGMA：WAL + NORMAL 同步，避免每次提交都 fsync"""
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-20000")
+    # 内存映射读取数据库文件（128 MB），减少读路径上的系统调用
+    conn.execute("PRAGMA mmap_size=134217728")
+    conn.execute("PRAGMA foreign_keys=ON")
 
 
 def get_db():
-    """获取数据库连接和游标"""
-    db_path = os.path.join(os.path.dirname(__file__), "pricing_system.db")
-    conn = sqlite3.connect(db_path, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn, conn.cursor()
+    """获取数据库连接和游标（连接在进程内复用，进程退出时自动关闭）
+
+    连接是自动提交模式（isolation_level=None），所有线程共用。
+    只读查询可直接执行；写入必须走 execute_write，或在 _WRITE_LOCK 内
+    执行 BEGIN…COMMIT。不要在写锁之外调用 conn.commit()。
+    """
+    global _CONN
+    if _CONN is None:
+        with _CONN_LOCK:
+            if _CONN is None:
+                # 语句缓存从默认 128 调大，页面里的固定查询都能复用已编译语句
+                conn = sqlite3.connect(
+                    DB_PATH,
+                    check_same_thread=False,
+                    isolation_level=None,
+                    cached_statements=256,
+                )
+                conn.row_factory = sqlite3.Row
+                _apply_pragmas(conn)
+                atexit.register(conn.close)
+                _CONN = conn
+    return _CONN, _CONN.cursor()
+
+
+def execute_write(sql, params=()):
+    """在写锁内执行单条写语句（自动提交模式下语句执行完即已提交）"""
+    _, c = get_db()
+    with _WRITE_LOCK:
+        return c.execute(sql, params)
 
 
 def current_user_id():
@@ -19,43 +82,37 @@ def current_user_id():
 # 数据库升级相关函数
 
 
-def _upgrade_logistics_battery():
-    """升级物流表电池相关字段"""
-    conn, c = get_db()
-    c.execute("PRAGMA table_info(logistics)")
-    cols = [col[1] for col in c.fetchall()]
-    if "battery_capacity_limit_wh" not in cols:
-        c.execute(
-            "ALTER TABLE logistics ADD COLUMN "
-            "battery_capacity_limit_wh REAL"
-        )
-    if "require_msds" not in cols:
-        c.execute(
-            "ALTER TABLE logistics ADD COLUMN "
-            "require_msds INTEGER DEFAULT 0"
-        )
-    conn.commit()
+@functools.lru_cache(maxsize=None)
+def _schema_snapshot() -> dict:
+    """一次查询取出所有表的列名：{表名: 列名集合}
 
+    结果缓存，改动表结构后需 _schema_snapshot.cache_clear()。
+    """
+    _, c = get_db()
+    schema = {}
+    for table, col in c.execute(
+        "SELECT m.name, p.name FROM sqlite_master AS m "
+        "JOIN pragma_table_info(m.name) AS p "
+        "WHERE m.type = 'table'"
+    ).fetchall():
+        schema.setdefault(table, set()).add(col)
+    return {table: frozenset(cols) for table, cols in schema.items()}
 
-def _upgrade_logistics_volume_coefficient():
-    """升级物流表体积系数字段"""
-    conn, c = get_db()
-    c.execute("PRAGMA table_info(logistics)")
-    cols = [col[1] for col in c.fetchall()]
-    if "volume_coefficient" not in cols:
-        c.execute(
-            "ALTER TABLE logistics ADD COLUMN "
-            "volume_coefficient REAL DEFAULT 5000"
-        )
-    conn.commit()
+
+def _table_cols(table: str) -> frozenset:
+    """返回表的列名集合（取自缓存的结构快照）"""
+    return _schema_snapshot().get(table, frozenset())
 
 
-def _upgrade_max_size_to_sides(table: str):
+def _set_table_cols(table: str, cols) -> None:
+    """ADD / DROP COLUMN 后直接改写快照中该表的列名，不必重新查询"""
+    _schema_snapshot()[table] = frozenset(cols)
+
+
+def _upgrade_max_size_to_sides(c, table: str):
     """升级旧表结构：max_size -> max_sum_of_sides + max_longest_side"""
-    conn, c = get_db()
     # 1. 检查是否已有新字段
-    c.execute(f"PRAGMA table_info({table})")
-    cols = [col[1] for col in c.fetchall()]
+    cols = _table_cols(table)
     if "max_sum_of_sides" in cols and "max_longest_side" in cols:
         return  # 已升级过
     # 2. 重命名旧表
@@ -104,22 +161,23 @@ def _upgrade_max_size_to_sides(table: str):
             user_id, name, type, min_days, max_days, price_limit,
             base_fee, weight_factor, volume_factor, battery_factor,
             min_weight, max_weight,
-            COALESCE(max_size, 0), COALESCE(max_size, 0),
+            max_size_or_0, max_size_or_0,
             volume_mode, longest_side_threshold,
             allow_battery, allow_flammable
-        FROM logistics_old
+        FROM (
+            SELECT *, COALESCE(max_size, 0) AS max_size_or_0
+            FROM logistics_old
+        )
         """
     )
     # 5. 清理旧表
     c.execute(f"DROP TABLE {table}_old")
-    conn.commit()
+    _schema_snapshot.cache_clear()
 
 
-def _upgrade_table_user_id(table: str):
+def _upgrade_table_user_id(c, table: str):
     """给旧表加 user_id 字段（如存在）"""
-    conn, c = get_db()
-    cols = [col[1]
-            for col in c.execute(f"PRAGMA table_info({table})").fetchall()]
+    cols = _table_cols(table)
     if "user_id" in cols:
         return
     c.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
@@ -163,10 +221,13 @@ def _upgrade_table_user_id(table: str):
                 name, type, min_days, max_days, price_limit,
                 base_fee, weight_factor, volume_factor, battery_factor,
                 min_weight, max_weight,
-                COALESCE(max_size, 0), COALESCE(max_size, 0),
+                max_size_or_0, max_size_or_0,
                 volume_mode, longest_side_threshold,
                 allow_battery, allow_flammable
-            FROM logistics_old
+            FROM (
+                SELECT *, COALESCE(max_size, 0) AS max_size_or_0
+                FROM logistics_old
+            )
             """
         )
     elif table == "products":
@@ -220,136 +281,283 @@ def _upgrade_table_user_id(table: str):
             """
         )
     c.execute(f"DROP TABLE {table}_old")
-    conn.commit()
+    _schema_snapshot.cache_clear()
 
 
-def _upgrade_old_volume_battery():
+def _upgrade_old_volume_battery(c):
     """升级旧表体积和电池因子字段"""
-    _upgrade_logistics_volume_coefficient()
-    conn, c = get_db()
-    cols = [col[1]
-            for col in c.execute("PRAGMA table_info(logistics)").fetchall()]
+    cols = _table_cols("logistics")
     # 如果旧表里还有 volume_factor / battery_factor 就 DROP COLUMN
     # SQLite ≥ 3.35 支持 DROP COLUMN；低版本需重建表
     for col in ["volume_factor", "battery_factor"]:
         if col in cols:
             c.execute(f"ALTER TABLE logistics DROP COLUMN {col}")
-    conn.commit()
+            cols = cols - {col}
+            _set_table_cols("logistics", cols)
+
+
+# 升级时需要补齐的列：(列名, 类型及默认值)
+_LOGISTICS_NEW_COLUMNS = [
+    ("volume_coefficient", "REAL DEFAULT 5000"),
+    ("battery_capacity_limit_wh", "REAL DEFAULT 0"),
+    ("require_msds", "INTEGER DEFAULT 0"),
+    ("fee_mode", "TEXT DEFAULT 'base_plus_continue'"),
+    ("first_fee", "REAL DEFAULT 0"),
+    ("first_weight_g", "INTEGER DEFAULT 0"),
+    ("continue_fee", "REAL DEFAULT 0"),
+    ("continue_unit", "TEXT DEFAULT '100'"),
+    ("price_min_rub", "REAL DEFAULT 0"),
+    ("max_second_side", "INTEGER DEFAULT 0"),
+    ("min_second_side", "INTEGER DEFAULT 0"),
+    ("min_length", "INTEGER DEFAULT 0"),
+    ("max_cylinder_sum", "INTEGER DEFAULT 0"),
+    ("min_cylinder_sum", "INTEGER DEFAULT 0"),
+    ("max_cylinder_length", "INTEGER DEFAULT 0"),
+    ("min_cylinder_length", "INTEGER DEFAULT 0"),
+    ("delivery_method", "TEXT DEFAULT 'unknown'"),
+    ("priority_group", "TEXT DEFAULT 'D'"),
+    ("price_limit_currency", "TEXT DEFAULT 'RUB'"),
+    ("price_min_currency", "TEXT DEFAULT 'RUB'"),
+    ("price_min", "REAL DEFAULT 0"),
+]
+
+_PRODUCTS_NEW_COLUMNS = [
+    ("cylinder_length", "REAL DEFAULT 0"),
+    ("promotion_discount", "REAL DEFAULT 0.05"),
+    ("promotion_cost_rate", "REAL DEFAULT 0.115"),
+    ("target_profit_margin", "REAL DEFAULT 0.5"),
+    ("commission_rate", "REAL DEFAULT 0.17"),
+    ("withdrawal_fee_rate", "REAL DEFAULT 0.01"),
+    ("payment_processing_fee", "REAL DEFAULT 0.01"),
+]
+
+
+def _migrate_columns(c, table: str, columns):
+    """升级：补齐表中缺失的列（在 init_db 的升级事务中执行）"""
+    cols = _table_cols(table)
+    missing = [(col, def_sql) for col, def_sql in columns if col not in cols]
+    if not missing:
+        return  # 已升级过
+    # executescript 会先提交外层事务，这里逐条执行以留在同一事务内
+    for col, def_sql in missing:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {col} {def_sql}")
+    _set_table_cols(table, cols | {col for col, _ in missing})
+
+
+# 口令哈希参数（scrypt），参数随哈希一起保存，调整后旧哈希仍可校验
+# SCRYPT_N 为 CPU/内存成本（2 的幂），可用环境变量 SCRYPT_N 调整；
+# 每翻一倍，登录和注册的哈希耗时也约翻一倍
+SCRYPT_N = int(os.environ.get("SCRYPT_N", "16384"))
+_SCRYPT_R = 8
+_SCRYPT_P = 1
+if SCRYPT_N < 2 or SCRYPT_N & (SCRYPT_N - 1):
+    raise ValueError(f"SCRYPT_N 必须是大于 1 的 2 的幂: {SCRYPT_N}")
+
+
+def _scrypt(key, salt, n, r, p):
+    """按参数计算 scrypt，显式给出 maxmem（OpenSSL 默认上限仅 32 MiB）"""
+    return hashlib.scrypt(
+        key, salt=salt, n=n, r=r, p=p, maxmem=128 * r * (n + p + 2)
+    )
 
 
-def _upgrade_logistics_new_fields():
-    """升级：新增重量计费字段、电池容量限制字段"""
-    conn, c = get_db()
-    cols = [col[1]
-            for col in c.execute("PRAGMA table_info(logistics)").fetchall()]
-    new_cols = {
-        "battery_capacity_limit_wh": "REAL DEFAULT 0",
-        "require_msds": "INTEGER DEFAULT 0",
-        "fee_mode": "TEXT DEFAULT 'base_plus_continue'",
-        "first_fee": "REAL DEFAULT 0",
-        "first_weight_g": "INTEGER DEFAULT 0",
-        "continue_fee": "REAL DEFAULT 0",
-        "continue_unit": "TEXT DEFAULT '100'",
-        "volume_coefficient": "INTEGER DEFAULT 5000",
-        "price_min_rub": "REAL DEFAULT 0",
-        "max_second_side": "INTEGER DEFAULT 0",
-        "min_second_side": "INTEGER DEFAULT 0",
-        "min_length": "INTEGER DEFAULT 0",
-        "max_cylinder_sum": "INTEGER DEFAULT 0",
-        "min_cylinder_sum": "INTEGER DEFAULT 0",
-        "max_cylinder_length": "INTEGER DEFAULT 0",
-        "min_cylinder_length": "INTEGER DEFAULT 0",
-        "delivery_method": "TEXT DEFAULT 'unknown'",
-        "priority_group": "TEXT DEFAULT 'D'",
-        "price_limit_currency": "TEXT DEFAULT 'RUB'",
-        "price_min_currency": "TEXT DEFAULT 'RUB'",
-    }
-    for col, def_sql in new_cols.items():
-        if col not in cols:
-            c.execute(f"ALTER TABLE logistics ADD COLUMN {col} {def_sql}")
-    conn.commit()
+def _password_key(password):
+    """口令的 SHA-256 摘要，作为 KDF 输入和校验缓存的键"""
+    return hashlib.sha256(password.encode()).digest()
 
 
-def _upgrade_products_cylinder_length():
-    """升级：新增产品圆柱长度字段"""
-    conn, c = get_db()
-    cols = [col[1]
-            for col in c.execute("PRAGMA table_info(products)").fetchall()]
-    if "cylinder_length" not in cols:
-        c.execute(
-            "ALTER TABLE products ADD COLUMN cylinder_length REAL DEFAULT 0"
-        )
-    conn.commit()
+def hash_password(password):
+    """生成加盐口令哈希：scrypt$n$r$p$盐$摘要"""
+    salt = os.urandom(16)
+    digest = _scrypt(
+        _password_key(password), salt, SCRYPT_N, _SCRYPT_R, _SCRYPT_P
+    )
+    return (
+        f"scrypt${SCRYPT_N}${_SCRYPT_R}${_SCRYPT_P}$"
+        f"{salt.hex()}${digest.hex()}"
+    )
 
 
-def _upgrade_products_new_fields():
-    """升级：新增产品定价相关字段"""
-    conn, c = get_db()
-    cols = [col[1]
-            for col in c.execute("PRAGMA table_info(products)").fetchall()]
-    new_cols = {
-        "promotion_discount": "REAL DEFAULT 0.05",
-        "promotion_cost_rate": "REAL DEFAULT 0.115",
-        "target_profit_margin": "REAL DEFAULT 0.5",
-        "commission_rate": "REAL DEFAULT 0.17",
-        "withdrawal_fee_rate": "REAL DEFAULT 0.01",
-        "payment_processing_fee": "REAL DEFAULT 0.01"
-    }
-    for col, def_sql in new_cols.items():
-        if col not in cols:
-            c.execute(f"ALTER TABLE products ADD COLUMN {col} {def_sql}")
-    conn.commit()
+def is_scrypt_hash(stored):
+    """是否为 scrypt 格式的口令哈希（否则视为旧版 SHA-256）"""
+    return stored.startswith("scrypt$")
 
 
-def _upgrade_logistics_price_min():
-    """升级：新增物流价格下限字段"""
-    conn, c = get_db()
-    cols = [col[1]
-            for col in c.execute("PRAGMA table_info(logistics)").fetchall()]
-    if "price_min" not in cols:
-        c.execute(
-            "ALTER TABLE logistics ADD COLUMN price_min REAL DEFAULT 0"
-        )
-    conn.commit()
+def _verify_legacy_password(key, stored):
+    """校验旧版无盐 SHA-256 十六进制哈希（按摘要字节常量时间比较）"""
+    try:
+        expected = bytes.fromhex(stored)
+    except ValueError:
+        return False
+    return hmac.compare_digest(key, expected)
+
+
+def _check_password_key(key, stored):
+    """按口令摘要校验存储的哈希（不经缓存）"""
+    # 先按格式分派，旧版哈希不进入 scrypt 解析
+    if not is_scrypt_hash(stored):
+        return _verify_legacy_password(key, stored)
+    # 格式损坏或参数越界的哈希一律视为校验失败
+    try:
+        _, n, r, p, salt, digest = stored.split("$")
+        actual = _scrypt(key, bytes.fromhex(salt), int(n), int(r), int(p))
+        return hmac.compare_digest(actual, bytes.fromhex(digest))
+    except (ValueError, OverflowError, TypeError):
+        return False
+
+
+# 最近校验成功的 (口令摘要, 存储哈希) -> 过期时间。只缓存成功结果，
+# 错误口令的尝试不会挤掉有效条目；条目数和存活时间都有上限
+_VERIFIED_MAX = 256
+_VERIFIED_TTL = 600
+_VERIFIED = {}
+_VERIFIED_LOCK = threading.Lock()
+
+
+def _verify_password_key(key, stored):
+    """按口令摘要校验存储的哈希（成功结果短期缓存，避免重复计算 scrypt）"""
+    if stored is None:
+        return False
+    entry = (key, stored)
+    now = time.monotonic()
+    with _VERIFIED_LOCK:
+        if _VERIFIED.get(entry, 0) > now:
+            return True
+    if not _check_password_key(key, stored):
+        return False
+    with _VERIFIED_LOCK:
+        _VERIFIED.pop(entry, None)
+        # 插入顺序即过期顺序：先淘汰已过期的，再按容量淘汰最早的
+        while _VERIFIED and (
+            len(_VERIFIED) >= _VERIFIED_MAX
+            or next(iter(_VERIFIED.values())) <= now
+        ):
+            del _VERIFIED[next(iter(_VERIFIED))]
+        _VERIFIED[entry] = now + _VERIFIED_TTL
+    return True
 
 
 def create_user(username, password, role="user", email=None):
     """创建用户"""
-    conn, c = get_db()
-    hashed = hashlib.sha256(password.encode()).hexdigest()
+    hashed = hash_password(password)
     try:
-        c.execute(
+        execute_write(
             "INSERT INTO users (username, password, role, email) "
             "VALUES (?, ?, ?, ?)",
             (username, hashed, role, email),
         )
-        conn.commit()
         return True
     except sqlite3.IntegrityError:
         return False
 
 
+# 旧版 SHA-256 口令在登录成功后由后台线程升级为 scrypt，不阻塞登录
+_REHASH_POOL = concurrent.futures.ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="password-rehash"
+)
+_REHASH_PENDING = set()
+_REHASH_LOCK = threading.Lock()
+
+
+def _upgrade_password_hash(user_id, legacy_hash, password):
+    """后台任务：把用户的旧版口令哈希替换为 scrypt 哈希"""
+    try:
+        # 哈希计算放在写锁外；只在口令未被修改时替换，避免覆盖期间重置的新口令
+        execute_write(
+            "UPDATE users SET password = ? WHERE id = ? AND password = ?",
+            (hash_password(password), user_id, legacy_hash),
+        )
+    except sqlite3.Error:
+        logging.exception("升级口令哈希失败: user_id=%s", user_id)
+    finally:
+        with _REHASH_LOCK:
+            _REHASH_PENDING.discard(user_id)
+
+
+def _schedule_password_rehash(user_id, legacy_hash, password):
+    """提交口令哈希升级任务（同一用户同时只排一个）"""
+    with _REHASH_LOCK:
+        if user_id in _REHASH_PENDING:
+            return
+        _REHASH_PENDING.add(user_id)
+    _REHASH_POOL.submit(_upgrade_password_hash, user_id, legacy_hash, password)
+
+
 def verify_user(identifier, password):
-    """验证用户"""
+    """验证用户（按用户名或邮箱查找，再在 Python 中校验口令）"""
     conn, c = get_db()
-    hashed = hashlib.sha256(password.encode()).hexdigest()
-    user = c.execute(
-        "SELECT * FROM users "
-        "WHERE (username = ? OR email = ?) AND password = ?",
-        (
-            identifier,
-            identifier,
-            hashed,
-        ),
-    ).fetchone()
-    return dict(user) if user else None
+    # 拆成两个分支，各自走 username / email 的唯一索引，避免 OR 退化为全表扫描
+    users = c.execute(
+        "SELECT id, username, role, email, password FROM users "
+        "WHERE username = ? "
+        "UNION ALL "
+        "SELECT id, username, role, email, password FROM users "
+        "WHERE email = ? AND username IS NOT ?",
+        (identifier, identifier, identifier),
+    ).fetchall()
+    # 口令摘要只算一次，多个候选账号共用
+    key = _password_key(password)
+    for user in users:
+        if _verify_password_key(key, user["password"]):
+            if not is_scrypt_hash(user["password"]):
+                _schedule_password_rehash(
+                    user["id"], user["password"], password
+                )
+            # 口令哈希不放进会话状态
+            return {
+                "id": user["id"],
+                "username": user["username"],
+                "role": user["role"],
+                "email": user["email"],
+            }
+    return None
+
+
+def _upgrade_schema(c):
+    """升级旧表结构并补齐索引（各步骤均可重复执行）"""
+    # 2. 升级旧表（只跑一次，共用同一个连接和游标）
+    _upgrade_table_user_id(c, "products")
+    _upgrade_table_user_id(c, "logistics")
+    _upgrade_max_size_to_sides(c, "logistics")
+    _upgrade_old_volume_battery(c)
+    _migrate_columns(c, "logistics", _LOGISTICS_NEW_COLUMNS)
+    _migrate_columns(c, "products", _PRODUCTS_NEW_COLUMNS)
+    # 3. 索引（users 的 username / email 已由 UNIQUE 约束自动建索引）
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_logistics_type "
+        "ON logistics(type)"
+    )
+    # 产品的列表和删除按 user_id 过滤；物流的列表按 user_id + type 过滤
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_products_user "
+        "ON products(user_id)"
+    )
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_logistics_user_type "
+        "ON logistics(user_id, type)"
+    )
 
 
 def init_db():
-    """初始化数据库"""
+    """初始化数据库（每个进程只执行一次）"""
+    global _DB_READY
+    if _DB_READY:
+        return
+    # 多个会话线程可能同时首次调用，只让一个线程执行建表和升级；
+    # 建表和升级事务都在写锁内，不会与其他线程的写入交错
+    with _DB_INIT_LOCK:
+        if _DB_READY:
+            return
+        with _WRITE_LOCK:
+            _create_and_upgrade_schema()
+        _DB_READY = True
+
+
+def _create_and_upgrade_schema():
+    """建表、升级旧表结构并写入初始管理员"""
     conn, c = get_db()
-    # 1. 三张基础表：users / products / logistics
-    c.execute(
+    # 1. 三张基础表：users / products / logistics（一次提交整段 DDL）
+    c.executescript(
         """
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY,
@@ -357,11 +565,7 @@ def init_db():
             password TEXT,
             role TEXT,
             email TEXT UNIQUE
-        )
-        """
-    )
-    c.execute(
-        """
+        );
         CREATE TABLE IF NOT EXISTS products (
             id INTEGER PRIMARY KEY,
             user_id INTEGER NOT NULL,
@@ -391,11 +595,7 @@ def init_db():
             commission_rate        REAL DEFAULT 0.17,
             withdrawal_fee_rate    REAL DEFAULT 0.01,
             payment_processing_fee REAL DEFAULT 0.01
-        )
-        """
-    )
-    c.execute(
-        """
+        );
         CREATE TABLE IF NOT EXISTS logistics (
             id INTEGER PRIMARY KEY,
             user_id INTEGER NOT NULL,
@@ -443,126 +643,86 @@ def init_db():
             priority_group TEXT DEFAULT 'D',
             price_limit_currency TEXT DEFAULT 'RUB',
             price_min_currency TEXT DEFAULT 'RUB'
-        )
+        );
         """
     )
+    # 2~4 在同一个事务中完成，整个升级只提交一次，失败则整体回滚
+    c.execute("BEGIN")
+    try:
+        # 2~3. 表结构已是当前版本时跳过全部升级检查
+        if c.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            _upgrade_schema(c)
+            c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        # 4. 初始管理员：仅在不存在时才计算口令哈希；另一进程可能抢先插入，
+        #    username 唯一，INSERT OR IGNORE 此时不做任何事
+        if not c.execute(
+            "SELECT 1 FROM users WHERE username = 'admin'"
+        ).fetchone():
+            c.execute(
+                "INSERT OR IGNORE INTO users "
+                "(username, password, role, email) VALUES (?, ?, ?, ?)",
+                ("admin", hash_password("admin123"), "admin", None),
+            )
+    except sqlite3.Error:
+        conn.rollback()
+        _schema_snapshot.cache_clear()
+        raise
     conn.commit()
-    # 2. 升级旧表（只跑一次）
-    _upgrade_table_user_id("products")
-    _upgrade_table_user_id("logistics")
-    _upgrade_max_size_to_sides("logistics")
-    _upgrade_old_volume_battery()
-    _upgrade_logistics_new_fields()
-    _upgrade_products_cylinder_length()
-    _upgrade_products_new_fields()
-    _upgrade_logistics_price_min()
-    # 3. 初始管理员
-    if not verify_user("admin", "admin123"):
-        create_user("admin", "admin123", "admin")
 
 
 def calculate_and_update_priority_groups():
-    """计算并更新物流优先级分组"""
+    """计算并更新物流优先级分组
+
+    陆运、空运分别统计时效不为 0 的物流的平均最快时效(A)、平均最慢时效(B)
+    和平均时效的平均值(D)，每条物流按低于平均值的个数分到 A/B/C/D 组，
+    时效全为 0 的物流分到 E 组（优先级最低）。各类型的平均值由 GROUP BY
+    聚合一次得到，再按类型各执行一条 UPDATE（不用 UPDATE ... FROM，
+    兼容 SQLite 3.33 以下版本）。
+    """
     conn, c = get_db()
-
-    # 获取所有物流数据
-    logistics = c.execute(
-        "SELECT id, type, min_days, max_days FROM logistics"
-    ).fetchall()
-
-    # 按类型分组
-    land_logistics = [log for log in logistics if log['type'] == 'land']
-    air_logistics = [log for log in logistics if log['type'] == 'air']
-
-    def calculate_group_averages(logistics_list):
-        """计算物流组的平均值"""
-        if not logistics_list:
-            return 0, 0, 0
-
-        # 过滤出时效不为0的物流（参与平均值计算）
-        valid_logistics = [
-            log for log in logistics_list
-            if log['min_days'] > 0 and log['max_days'] > 0
-        ]
-
-        if not valid_logistics:
-            return 0, 0, 0
-
-        # 计算平均最快时效(A)
-        min_days_sum = sum(log['min_days'] for log in valid_logistics)
-        avg_fastest = min_days_sum / len(valid_logistics)
-
-        # 计算平均最慢时效(B)
-        max_days_sum = sum(log['max_days'] for log in valid_logistics)
-        avg_slowest = max_days_sum / len(valid_logistics)
-
-        # 计算每个物流的平均时效(C)的平均值(D)
-        avg_times = []
-        for log in valid_logistics:
-            avg_time = (log['min_days'] + log['max_days']) / 2
-            avg_times.append(avg_time)
-        avg_overall = sum(avg_times) / len(avg_times)
-
-        return avg_fastest, avg_slowest, avg_overall
-
-    def assign_priority_group(log, avg_fastest, avg_slowest, avg_overall):
-        """为单个物流分配优先级组"""
-        min_days = log['min_days']
-        max_days = log['max_days']
-
-        # 如果时效为0，分配为E组（优先级最低）
-        if min_days == 0 and max_days == 0:
-            return 'E'
-
-        avg_time = (min_days + max_days) / 2
-
-        # 计算有多少个值小于平均值
-        count_below_avg = 0
-        if min_days < avg_fastest:
-            count_below_avg += 1
-        if max_days < avg_slowest:
-            count_below_avg += 1
-        if avg_time < avg_overall:
-            count_below_avg += 1
-
-        # 根据数量分配组别
-        if count_below_avg == 3:
-            return 'A'
-        elif count_below_avg == 2:
-            return 'B'
-        elif count_below_avg == 1:
-            return 'C'
-        else:
-            return 'D'
-
-    # 计算陆运组平均值
-    land_avg_fastest, land_avg_slowest, land_avg_overall = (
-        calculate_group_averages(land_logistics)
-    )
-
-    # 计算空运组平均值
-    air_avg_fastest, air_avg_slowest, air_avg_overall = (
-        calculate_group_averages(air_logistics)
-    )
-
-    # 更新陆运物流的优先级组
-    for log in land_logistics:
-        group = assign_priority_group(
-            log, land_avg_fastest, land_avg_slowest, land_avg_overall
-        )
-        c.execute(
-            "UPDATE logistics SET priority_group = ? WHERE id = ?",
-            (group, log['id'])
-        )
-
-    # 更新空运物流的优先级组
-    for log in air_logistics:
-        group = assign_priority_group(
-            log, air_avg_fastest, air_avg_slowest, air_avg_overall
-        )
-        c.execute(
-            "UPDATE logistics SET priority_group = ? WHERE id = ?",
-            (group, log['id'])
-        )
-
-    conn.commit()
+    with _WRITE_LOCK:
+        try:
+            c.execute("BEGIN")
+            averages = {
+                row[0]: row[1:]
+                for row in c.execute(
+                    """
+                    SELECT
+                        type,
+                        AVG(min_days),
+                        AVG(max_days),
+                        AVG((min_days + max_days) / 2.0)
+                    FROM logistics
+                    WHERE type IN ('land', 'air')
+                      AND min_days > 0 AND max_days > 0
+                    GROUP BY type
+                    """
+                )
+            }
+            for logistic_type in ("land", "air"):
+                avg_fastest, avg_slowest, avg_overall = averages.get(
+                    logistic_type, (0, 0, 0)
+                )
+                c.execute(
+                    """
+                    UPDATE logistics
+                    SET priority_group = CASE
+                        WHEN min_days = 0 AND max_days = 0 THEN 'E'
+                        ELSE CASE
+                            (min_days < ?) + (max_days < ?)
+                            + ((min_days + max_days) / 2.0 < ?)
+                            WHEN 3 THEN 'A'
+                            WHEN 2 THEN 'B'
+                            WHEN 1 THEN 'C'
+                            ELSE 'D'
+                        END
+                    END
+                    WHERE type = ?
+                    """,
+                    (avg_fastest, avg_slowest, avg_overall, logistic_type),
+                )
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        conn.commit()
@@ -2,16 +2,48 @@ import json
 import logging
 import os
 import requests
+import tempfile
 import threading
 import time
 from abc import ABC, abstractmethod
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+try:
+    import orjson  # 可选依赖：C 实现的 JSON 编解码
+except ImportError:
+    orjson = None
+
 
 logging.basicConfig(level=logging.INFO)
 
 
+def _json_loads(data: bytes):
+    """解析 JSON（装了 orjson 时用 orjson）"""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def _json_dumps(obj) -> bytes:
+    """序列化为 JSON 字节串（装了 orjson 时用 orjson）"""
+    return orjson.dumps(obj) if orjson else json.dumps(obj).encode()
+
+
+def _make_session() -> requests.Session:
+    """创建带重试和连接池的 HTTP 会话"""
+    session = requests.Session()
+    retry = Retry(total=2, backoff_factor=0.5,
+                  status_forcelist=[500, 502, 503, 504],
+                  allowed_methods=frozenset(['GET']))
+    session.mount("https://", HTTPAdapter(
+        pool_connections=4, pool_maxsize=8, max_retries=retry))
+    session.headers.update({"User-Agent": "Mozilla/5.0"})
+    return session
+
+
+# 所有汇率提供者共用一个会话，复用到同一接口的 TCP/TLS 连接
+_SESSION = _make_session()
+
+
 # ---------- 抽象接口
 class ExchangeRateProvider(ABC):
     @abstractmethod
@@ -19,31 +51,27 @@ class ExchangeRateProvider(ABC):
         pass
 
 
-# ---------- 中国银行官网实时抓取
-class BocProvider(ExchangeRateProvider):
+# ---------- 汇率提供者：一次请求同时得到卢布和美元汇率
+class CombinedRatesProvider:
     """
     使用 exchangerate-api.com 免费接口
-    直接返回 1 RUB → CNY 的实时汇率
+    请求一次 /latest/USD，返回 (1 RUB → CNY, 1 USD → CNY) 的实时汇率
     """
     def __init__(self):
-        self.url = "https://api.exchangerate-api.com/v4/latest/RUB"
-        self.session = requests.Session()
-        retry = Retry(total=2, backoff_factor=0.5,
-                      status_forcelist=[500, 502, 503, 504],
-                      allowed_methods=frozenset(['GET']))
-        self.session.mount("https://", HTTPAdapter(max_retries=retry))
-        self.session.headers.update({"User-Agent": "Mozilla/5.0"})
+        self.url = "https://api.exchangerate-api.com/v4/latest/USD"
 
-    def get_rate(self) -> float:
+    def get_rates(self) -> tuple[float, float]:
         try:
-            r = self.session.get(self.url, timeout=10)
+            r = _SESSION.get(self.url, timeout=10)
             r.raise_for_status()
-            data = r.json()
-            # rates.CNY 即 1 RUB 兑多少 CNY
-            return float(data["rates"]["CNY"])
+            rates = _json_loads(r.content)["rates"]
+            # rates.CNY 即 1 USD 兑多少 CNY，rates.RUB 即 1 USD 兑多少 RUB
+            usd_cny = float(rates["CNY"])
+            # 交叉汇率：1 RUB 兑 usd_cny / RUB 个 CNY
+            return usd_cny / float(rates["RUB"]), usd_cny
         except Exception as e:
             logging.warning("第三方汇率接口失败: %s", e)
-        raise ValueError("第三方接口未返回卢布汇率")
+        raise ValueError("第三方接口未返回汇率")
 
 
 # ---------- 兜底实现：固定值
@@ -55,159 +83,132 @@ class FallbackProvider(ExchangeRateProvider):
         return self.default
 
 
-# ---------- 双缓存服务（单例）
-class ExchangeRateService:
-    _instance = None
-    _lock = threading.Lock()
-    _fallback_file = os.path.join(
-        os.path.dirname(__file__),
-        "rate_fallback.json"
-    )
+# ---------- 双缓存服务（单例基类）
+class CurrencyRateService:
+    """某一币种兑人民币的汇率服务：内存缓存 + 兜底文件
+
+    子类给出兜底文件、默认汇率和日志用的币种名称，每个子类各自是单例；
+    汇率由后台刷新线程通过 _update 写入。
+    """
+    _fallback_file: str
+    _default: float
+    _label: str = ""
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._instance = None
+        cls._lock = threading.Lock()
 
     def __new__(cls):
-        with cls._lock:
-            if cls._instance is None:
-                cls._instance = super().__new__(cls)
-                cls._instance._init()
+        # 双重检查：实例建好后直接返回，不再每次加锁
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    instance = super().__new__(cls)
+                    instance._init()
+                    cls._instance = instance
         return cls._instance
 
     def _init(self):
-        self._provider = BocProvider()
-        self._fallback = FallbackProvider()
-        self._rate: float = 9.02
-        self._last: float = 0
+        self._fallback = FallbackProvider(default=self._default)
+        # (汇率, 更新时间) 放在一个元组里整体替换，读方不会读到新旧混杂的值
+        self._state: tuple[float, float] = (self._default, 0.0)
         self._load_fallback()
-        self._start_async_refresh()
+        _start_async_refresh()
 
     def _load_fallback(self):
         try:
-            with open(self._fallback_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            self._rate = data["rate"]
-            self._last = data["ts"]
-            logging.info("兜底汇率已加载: %.5f", self._rate)
+            with open(self._fallback_file, "rb") as f:
+                data = _json_loads(f.read())
+            self._state = (data["rate"], data["ts"])
+            logging.info("%s兜底汇率已加载: %.5f",
+                         self._label, self._state[0])
         except (FileNotFoundError, json.JSONDecodeError, KeyError):
-            self._rate = self._fallback.get_rate()
-            self._last = time.time()
-            logging.warning("兜底文件缺失，使用默认值: %.5f", self._rate)
+            self._state = (self._fallback.get_rate(), time.time())
+            logging.warning("%s兜底文件缺失，使用默认值: %.5f",
+                            self._label, self._state[0])
 
     def _save_fallback(self, rate: float):
+        # 先整体写入同目录下的唯一临时文件并落盘，再原子替换；
+        # 崩溃时不会留下写了一半的文件，多个进程也不会互相覆盖临时文件
+        buf = _json_dumps({"rate": rate, "ts": time.time()})
+        tmp = None
         try:
-            with open(self._fallback_file, "w", encoding="utf-8") as f:
-                json.dump({"rate": rate, "ts": time.time()}, f)
+            with tempfile.NamedTemporaryFile(
+                dir=os.path.dirname(self._fallback_file) or ".",
+                prefix=os.path.basename(self._fallback_file) + ".",
+                suffix=".tmp",
+                delete=False,
+            ) as f:
+                tmp = f.name
+                f.write(buf)
+                f.flush()
+                # 临时文件默认 0600，改回普通文件的 0644，替换后其他账号仍可读
+                os.fchmod(f.fileno(), 0o644)
+                os.fsync(f.fileno())
+            os.replace(tmp, self._fallback_file)
         except OSError:
-            logging.exception("无法保存兜底汇率")
-
-    def _start_async_refresh(self):
-        if not getattr(self, "_refresher_started", False):
-            threading.Thread(target=self._async_refresh, daemon=True).start()
-            self._refresher_started = True
-
-    def _async_refresh(self):
-        while True:
-            try:
-                new_rate = self._provider.get_rate()
-                self._rate = new_rate
-                self._last = time.time()
-                self._save_fallback(new_rate)
-                logging.info("异步刷新汇率: %.5f", new_rate)
-            except requests.RequestException:
-                logging.exception("异步获取汇率失败，继续使用旧值")
-            time.sleep(1800)  # 30 分钟
+            logging.exception("无法保存%s兜底汇率", self._label)
+            if tmp is not None:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+
+    def _update(self, rate: float):
+        """写入刷新得到的新汇率并保存兜底文件"""
+        self._state = (rate, time.time())
+        self._save_fallback(rate)
 
     def get_exchange_rate(self) -> float:
-        return self._rate
+        return self._state[0]
 
 
-# ---------- 美元汇率提供者
-class UsdProvider(ExchangeRateProvider):
-    """
-    使用 exchangerate-api.com 免费接口
-    获取 1 USD → CNY 的实时汇率
-    """
-    def __init__(self):
-        self.url = "https://api.exchangerate-api.com/v4/latest/USD"
-        self.session = requests.Session()
-        retry = Retry(total=2, backoff_factor=0.5,
-                      status_forcelist=[500, 502, 503, 504],
-                      allowed_methods=frozenset(['GET']))
-        self.session.mount("https://", HTTPAdapter(max_retries=retry))
-        self.session.headers.update({"User-Agent": "Mozilla/5.0"})
-
-    def get_rate(self) -> float:
-        try:
-            r = self.session.get(self.url, timeout=10)
-            r.raise_for_status()
-            data = r.json()
-            # rates.CNY 即 1 USD 兑多少 CNY
-            return float(data["rates"]["CNY"])
-        except Exception as e:
-            logging.warning("美元汇率接口失败: %s", e)
-        raise ValueError("第三方接口未返回美元汇率")
+# ---------- 卢布汇率服务
+class ExchangeRateService(CurrencyRateService):
+    _fallback_file = os.path.join(
+        os.path.dirname(__file__),
+        "rate_fallback.json"
+    )
+    _default = 9.02
 
 
 # ---------- 美元汇率服务
-class UsdExchangeRateService:
-    _instance = None
-    _lock = threading.Lock()
+class UsdExchangeRateService(CurrencyRateService):
     _fallback_file = os.path.join(
         os.path.dirname(__file__),
         "usd_rate_fallback.json"
     )
+    _default = 7.2  # 美元默认汇率
+    _label = "美元"
 
-    def __new__(cls):
-        with cls._lock:
-            if cls._instance is None:
-                cls._instance = super().__new__(cls)
-                cls._instance._init()
-        return cls._instance
 
-    def _init(self):
-        self._provider = UsdProvider()
-        self._fallback = FallbackProvider(default=7.2)  # 美元默认汇率
-        self._rate: float = 7.2
-        self._last: float = 0
-        self._load_fallback()
-        self._start_async_refresh()
+# ---------- 后台刷新：一个线程、一次请求同时更新两个服务
+_REFRESH_INTERVAL = 1800  # 30 分钟
+_refresh_lock = threading.Lock()
+_refresher_started = False
 
-    def _load_fallback(self):
-        try:
-            with open(self._fallback_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            self._rate = data["rate"]
-            self._last = data["ts"]
-            logging.info("美元兜底汇率已加载: %.5f", self._rate)
-        except (FileNotFoundError, json.JSONDecodeError, KeyError):
-            self._rate = self._fallback.get_rate()
-            self._last = time.time()
-            logging.warning("美元兜底文件缺失，使用默认值: %.5f", self._rate)
 
-    def _save_fallback(self, rate: float):
-        try:
-            with open(self._fallback_file, "w", encoding="utf-8") as f:
-                json.dump({"rate": rate, "ts": time.time()}, f)
-        except OSError:
-            logging.exception("无法保存美元兜底汇率")
-
-    def _start_async_refresh(self):
-        if not getattr(self, "_refresher_started", False):
-            threading.Thread(target=self._async_refresh, daemon=True).start()
-            self._refresher_started = True
-
-    def _async_refresh(self):
-        while True:
-            try:
-                new_rate = self._provider.get_rate()
-                self._rate = new_rate
-                self._last = time.time()
-                self._save_fallback(new_rate)
-                logging.info("异步刷新美元汇率: %.5f", new_rate)
-            except requests.RequestException:
-                logging.exception("异步获取美元汇率失败，继续使用旧值")
-            time.sleep(1800)  # 30 分钟
+def _start_async_refresh():
+    global _refresher_started
+    with _refresh_lock:
+        if not _refresher_started:
+            threading.Thread(target=_async_refresh, daemon=True).start()
+            _refresher_started = True
 
-    def get_exchange_rate(self) -> float:
-        return self._rate
+
+def _async_refresh():
+    provider = CombinedRatesProvider()
+    while True:
+        try:
+            rub_rate, usd_rate = provider.get_rates()
+            ExchangeRateService()._update(rub_rate)
+            UsdExchangeRateService()._update(usd_rate)
+            logging.info("异步刷新汇率: RUB %.5f, USD %.5f",
+                         rub_rate, usd_rate)
+        except (requests.RequestException, ValueError):
+            logging.exception("异步获取汇率失败，继续使用旧值")
+        time.sleep(_REFRESH_INTERVAL)
 
 
 # ---------- 全局单例
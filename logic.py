@@ -1,7 +1,8 @@
 # logic.py
 
 import math
-from exchange_service import ExchangeRateService
+from exchange_service import ExchangeRateService, get_usd_rate
+from functools import lru_cache
 
 
 def calculate_logistic_cost(logistic, product, debug=False):
@@ -274,8 +275,6 @@ def calculate_logistic_cost(logistic, product, debug=False):
 def calculate_pricing(product, land_logistics, air_logistics,
                       priority="低价优先"):
     """计算定价"""
-    from functools import lru_cache
-
     # 1. 基础数据
     unit_price = float(product["unit_price"])
     labeling_fee = float(product["labeling_fee"])
@@ -316,8 +315,7 @@ def calculate_pricing(product, land_logistics, air_logistics,
 
             # 价格限制检查
             # 获取物流规则的价格限制
-            # 预先获取USD汇率，避免重复导入和调用
-            from exchange_service import get_usd_rate
+            # 预先获取USD汇率，避免重复调用
             usd_rate = get_usd_rate()
 
             # 根据货币类型读取正确的价格限制值
@@ -688,7 +686,6 @@ def _debug_filter_reason(logistic: dict, product: dict) -> str | None:
             # 如果货币是USD，需要从price_limit字段读取（存储的是转换后的CNY值）
             # 然后转换回USD
             price_limit_cny = logistic.get("price_limit", 0)
-            from exchange_service import get_usd_rate
             usd_rate = get_usd_rate()
             limit_value = (price_limit_cny / usd_rate
                            if price_limit_cny > 0 else 0)
@@ -700,13 +697,11 @@ def _debug_filter_reason(logistic: dict, product: dict) -> str | None:
             # 如果货币是USD，需要从price_min字段读取（存储的是转换后的CNY值）
             # 然后转换回USD
             price_min_cny = logistic.get("price_min", 0)
-            from exchange_service import get_usd_rate
             usd_rate = get_usd_rate()
             min_value = (price_min_cny / usd_rate
                          if price_min_cny > 0 else 0)
 
         # 根据货币类型进行价格比较
-        from exchange_service import get_usd_rate
         usd_rate = get_usd_rate()
 
         if limit_currency == "USD" and limit_value > 0:
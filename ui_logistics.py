@@ -1,14 +1,15 @@
 import streamlit as st
 import pandas as pd
 from db_utils import (
-    get_db, current_user_id, calculate_and_update_priority_groups
+    get_db, current_user_id, calculate_and_update_priority_groups,
+    execute_write,
 )
 from exchange_service import ExchangeRateService, get_usd_rate
 
 
 def logistics_page():
     """物流规则页面"""
-    conn, c = get_db()
+    conn, _ = get_db()
     uid = current_user_id()
 
     if st.session_state.get("edit_logistic_id"):
@@ -325,7 +326,7 @@ def logistics_page():
                     "?,?,?,?,?,?,?,?,?, "
                     "?,?,?,?,?,?,?,?,?,?,?)"
                 )
-                c.execute(
+                execute_write(
                     insert_sql,
                     (
                         uid,
@@ -373,7 +374,6 @@ def logistics_page():
                         "USD" if price_currency == "美元" else "RUB",
                     ),
                 )
-                conn.commit()
 
                 # 重新计算优先级分组
                 calculate_and_update_priority_groups()
@@ -454,11 +454,10 @@ def logistics_page():
         with col_confirm:
             if st.button("确定删除", key="confirm_delete_logistic"):
                 logistic_id = st.session_state.delete_confirm_logistic_id
-                c.execute(
+                execute_write(
                     "DELETE FROM logistics WHERE id=? AND user_id=?",
                     (logistic_id, uid),
                 )
-                conn.commit()
 
                 # 重新计算优先级分组
                 calculate_and_update_priority_groups()
@@ -473,7 +472,7 @@ def logistics_page():
 
 def edit_logistic_form():
     """物流编辑表单"""
-    conn, c = get_db()
+    _, c = get_db()
     uid = current_user_id()
     lid = st.session_state.edit_logistic_id
     row = c.execute(
@@ -820,7 +819,7 @@ def edit_logistic_form():
                 "price_min_currency=? "
                 "WHERE id=? AND user_id=?"
             )
-            c.execute(
+            execute_write(
                 update_sql,
                 (
                     name,
@@ -869,7 +868,6 @@ def edit_logistic_form():
                     uid,
                 ),
             )
-            conn.commit()
 
             # 重新计算优先级分组
             calculate_and_update_priority_groups()
@@ -1,11 +1,11 @@
 import streamlit as st
 import pandas as pd
-from db_utils import get_db, current_user_id
+from db_utils import get_db, current_user_id, execute_write
 
 
 def products_page():
     """产品管理页面"""
-    conn, c = get_db()
+    conn, _ = get_db()
     uid = current_user_id()
 
     if st.session_state.get("edit_product_id"):
@@ -181,7 +181,7 @@ def products_page():
             if missing_fields:
                 st.error(f"请填写以下必填字段：{', '.join(missing_fields)}")
             else:
-                c.execute(
+                execute_write(
                     "INSERT INTO products ("
                     "user_id, name, russian_name, category, model, "
                     "unit_price, weight_g, length_cm, width_cm, height_cm, "
@@ -224,7 +224,6 @@ def products_page():
                         cylinder_length if is_cylinder else 0.0,
                     ),
                 )
-                conn.commit()
                 st.success("产品添加成功！")
                 st.session_state.products_data = pd.read_sql(
                     "SELECT id, name, category, weight_g "
@@ -264,11 +263,10 @@ def products_page():
             with col_confirm:
                 if st.button("确定删除", key="confirm_delete_product"):
                     product_id = st.session_state.delete_confirm_product_id
-                    c.execute(
+                    execute_write(
                         "DELETE FROM products WHERE id=? AND user_id=?",
                         (product_id, uid),
                     )
-                    conn.commit()
                     st.session_state.products_data = pd.read_sql(
                         "SELECT id, name, category, weight_g "
                         "FROM products "
@@ -288,7 +286,7 @@ def products_page():
 
 def edit_product_form():
     """编辑产品表单"""
-    conn, c = get_db()
+    _, c = get_db()
     uid = current_user_id()
     pid = st.session_state.edit_product_id
     row = c.execute(
@@ -482,7 +480,7 @@ def edit_product_form():
         if missing_fields:
             st.error(f"请填写以下必填字段：{', '.join(missing_fields)}")
         else:
-            c.execute(
+            execute_write(
                 """UPDATE products SET
                     name=?, russian_name=?, category=?, model=?,
                     weight_g=?, length_cm=?, width_cm=?, height_cm=?,
@@ -526,7 +524,6 @@ def edit_product_form():
                     uid,
                 ),
             )
-            conn.commit()
             st.success("产品修改成功！")
             del st.session_state.edit_product_id
             st.rerun()
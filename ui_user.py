@@ -1,14 +1,16 @@
+import re
 import streamlit as st
 import pandas as pd
-import hashlib
 import sqlite3
-from db_utils import get_db
+from db_utils import (
+    create_user, execute_write, get_db, hash_password, verify_user,
+)
 
 
 def user_management_page():
     """用户管理页面"""
     st.title("用户管理")
-    conn, c = get_db()
+    conn, _ = get_db()
     with st.expander("添加新用户"):
         with st.form("add_user_form"):
             username = st.text_input("用户名*")
@@ -18,14 +20,13 @@ def user_management_page():
                 if not username or not password:
                     st.error("请填写所有必填字段")
                 else:
-                    hashed = hashlib.sha256(password.encode()).hexdigest()
+                    hashed = hash_password(password)
                     try:
-                        c.execute(
+                        execute_write(
                             "INSERT INTO users (username, password, role) "
                             "VALUES (?, ?, ?)",
                             (username, hashed, role),
                         )
-                        conn.commit()
                         st.success("用户添加成功！")
                         st.rerun()
                     except sqlite3.IntegrityError:
@@ -53,20 +54,18 @@ def user_management_page():
                     if not new_pwd:
                         st.error("请输入新密码")
                     else:
-                        hashed = hashlib.sha256(new_pwd.encode()).hexdigest()
-                        c.execute(
+                        hashed = hash_password(new_pwd)
+                        execute_write(
                             "UPDATE users SET password=? WHERE id=?",
                             (hashed, user_id),
                         )
-                        conn.commit()
                         st.success("密码已更新！")
                         st.rerun()
         if st.button("删除用户", key=f"del_user_{user_id}"):
             if user_id == st.session_state.user["id"]:
                 st.error("不能删除当前登录用户")
             else:
-                c.execute("DELETE FROM users WHERE id=?", (user_id,))
-                conn.commit()
+                execute_write("DELETE FROM users WHERE id=?", (user_id,))
                 st.success("用户已删除！")
                 st.rerun()
 
@@ -82,7 +81,6 @@ def login_or_register_page():
             pwd = st.text_input("密码", type="password")
             submitted = st.form_submit_button("登录")
             if submitted:
-                from db_utils import verify_user
                 user = verify_user(identifier, pwd)
                 if user:
                     st.session_state.user = user
@@ -98,8 +96,6 @@ def login_or_register_page():
             pwd2 = st.text_input("确认密码", type="password")
             submitted = st.form_submit_button("注册")
             if submitted:
-                import re
-                from db_utils import create_user
                 if pwd1 != pwd2:
                     st.error("两次密码不一致")
                 elif not re.match(r"[^@]+@[^@]+\.[^@]+", email):